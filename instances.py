@@ -0,0 +1,120 @@
+"""
+instances.py
+
+A module to read SAT problems in DIMACS format one by one from a folder,
+a single .cnf file or an archive (.tar, .tar.gz, .tgz, .zip) such as the
+SATLIB benchmark families, without unpacking the archive to disk. The
+functions are parsed in a background thread ahead of the solving.
+"""
+
+#### Libraries
+# Standard library
+import os
+import queue
+import tarfile
+import threading
+import zipfile
+
+# My library
+from myAmbSAT import parse_dimacs
+
+def cnf_name(path):
+    """Name of a function: name of its file without folders and .cnf"""
+    name = os.path.basename(path)
+    return name[:name.index('.cnf')]
+
+def iter_dimacs(path):
+    """Read the text of each function one by one
+
+    Args:
+        path (string): folder, .cnf file or archive with .cnf files
+
+    Yields:
+        name (string): name of the function
+        text (string): text of the file which describes the function
+    """
+    if os.path.isdir(path):
+        for filename in sorted(os.listdir(path)):
+            if filename.endswith('.cnf'):
+                with open(os.path.join(path, filename)) as f:
+                    yield cnf_name(filename), f.read()
+    elif path.endswith('.cnf'):
+        with open(path) as f:
+            yield cnf_name(path), f.read()
+    elif zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and info.filename.endswith('.cnf'):
+                    yield (cnf_name(info.filename),
+                           archive.read(info).decode())
+    elif tarfile.is_tarfile(path):
+        # reading the archive as a stream, member after member
+        with tarfile.open(path, 'r|*') as archive:
+            for member in archive:
+                if member.isfile() and member.name.endswith('.cnf'):
+                    f = archive.extractfile(member)
+                    yield cnf_name(member.name), f.read().decode()
+    else:
+        raise ValueError("not a folder, .cnf file or archive: "+path)
+
+def iter_instances(path):
+    """Parse each function one by one
+
+    Args:
+        path (string): folder, .cnf file or archive with .cnf files
+
+    Yields:
+        name (string): name of the function
+        clauses (list): stores each clause as a list of strings
+        n_vars (int): number of variables in the function
+    """
+    for name, text in iter_dimacs(path):
+        clauses, n_vars = parse_dimacs(text.splitlines())
+        yield name, clauses, n_vars
+
+def prefetch(iterable, size=8):
+    """Take the items of an iterable in a background thread, keeping at
+    most size of them ready
+
+    Args:
+        iterable (iterable): items to take, e.g. iter_instances(path)
+        size (int): maximum number of items taken in advance
+
+    Yields:
+        the items of the iterable in the same order
+    """
+    items = queue.Queue(size)
+    stop = threading.Event()
+
+    def put(item):
+        # giving up when the items are not needed any more
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((True, item)):
+                    return
+        except Exception as err:
+            put((False, err))
+            return
+        put((False, None))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            has_item, item = items.get()
+            if not has_item:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        stop.set()
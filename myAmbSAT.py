@@ -17,29 +17,39 @@ def user_input(filename):
     Args:
         filename(string): name of the file which describes the function
     
+    Returns:
+        clauses (list): stores each clause as a list of strings
+        n_vars (int): number of variables in the function
+    """
+    with open(filename) as f:
+        return parse_dimacs(f)
+
+def parse_dimacs(lines):
+    """Store all clauses and number of variables from the lines of a
+    function in DIMACS format
+    
+    Args:
+        lines (iterable): lines of the file which describes the function
+    
     Returns:
         clauses (list): stores each clause as a list of strings
         n_vars (int): number of variables in the function
     """
     # writing each clause as a list inside one list
     clauses = []
-    with open(filename) as f:
-        for line in f:
-            if len(line)!=0:
-                if line[0] == 'p':
-                    # number of variables as indicated in the file
-                    n_vars = int(line.split()[2])
-                elif line[0] not in ('c','%'):
-                    # lines which contain states for clauses
-                    clause = []
-                    for n in line.split(" "):
-                        if n != "0\n":
-                            clause.append(n)
-                    if len(clause) >= 3:
-                        clauses.append(clause)
-    # removing blank space in the first line
-    if clauses[0][0]=="":
-        clauses[0] = clauses[0][1:]
+    for line in lines:
+        if len(line)!=0:
+            if line[0] == 'p':
+                # number of variables as indicated in the file
+                n_vars = int(line.split()[2])
+            elif line[0] not in ('c','%'):
+                # lines which contain states for clauses
+                clause = []
+                for n in line.split():
+                    if n != "0":
+                        clause.append(n)
+                if len(clause) >= 3:
+                    clauses.append(clause)
     return clauses, n_vars
 
 def create_INTRA(n_vars):
@@ -267,6 +277,354 @@ def check_solved(X,L):
         solved = True
     return solved
 
+def count_unstable(X,L):
+    """Count the units which are not stable yet (the same condition as in
+    check_solved), used as a progress signal of the system
+    
+    Args:
+        X (dict): current X-values of each unit
+        L (dict): L-values of each unit for the next loop
+    
+    Returns:
+        unstable (int): number of unstable units
+    """
+    unstable=0
+    for var in X:
+        if not((X[var]==1 and L[var]==0) or (X[var]<=0 and L[var]==1)):
+            unstable+=1
+    return unstable
+
+def luby(i):
+    """Find the i-th element of the Luby sequence (1,1,2,1,1,2,4,1,...)
+    
+    Args:
+        i (int): position in the sequence starting from 1
+    
+    Returns:
+        (int): element of the sequence
+    """
+    k=1
+    while (1<<k)-1 < i:
+        k+=1
+    if i == (1<<k)-1:
+        return 1<<(k-1)
+    return luby(i-(1<<(k-1))+1)
+
+def restart_limit(restart, k, base, factor):
+    """Determine how many iterations without progress are allowed before
+    the next restart
+    
+    Args:
+        restart (string): restart schedule ("fixed", "geometric", "luby")
+        k (int): number of restarts made so far
+        base (int): number of iterations of the first restart interval
+        factor (float): growth of the interval for geometric schedule
+    
+    Returns:
+        (int): allowed number of iterations without progress
+    """
+    if restart == "fixed":
+        return base
+    elif restart == "geometric":
+        return int(base*factor**k)
+    elif restart == "luby":
+        return base*luby(k+1)
+    raise ValueError("unknown restart schedule: "+str(restart))
+
+def restart_system(X,Z,restart_action,perturb):
+    """Restart the system either by re-seeding Z (starting again from
+    neutral X-values) or by perturbing the X-values of some units
+    
+    Args:
+        X (dict): current X-values of each unit
+        Z (dict): current Z-values of each unit
+        restart_action (string): "reseed" or "perturb"
+        perturb (float): proportion of units perturbed
+    
+    Returns:
+        X (dict): new X-values of each unit
+        Z (dict): new Z-values of each unit
+    """
+    if restart_action == "reseed":
+        for var in X:
+            X[var] = 0
+            Z[var] = random.random()
+    elif restart_action == "perturb":
+        for var in random.sample(list(X), max(1,int(perturb*len(X)))):
+            X[var] = random.choice((-1,0,1))
+    else:
+        raise ValueError("unknown restart action: "+str(restart_action))
+    return X, Z
+
+def compile_clauses(clauses):
+    """Convert the clauses to lists of integer literals
+    
+    Args:
+        clauses (list): stores each clause as a list of strings
+    
+    Returns:
+        literals (list): stores each clause as a list of ints
+    """
+    literals = []
+    for clause in clauses:
+        literals.append([int(var) for var in clause])
+    return literals
+
+def count_unsatisfied(literals,values):
+    """Count the clauses which are False for a set of inputs
+    
+    Args:
+        literals (list): stores each clause as a list of ints
+        values (list): value of each variable (index 0 is not used)
+    
+    Returns:
+        unsatisfied (int): number of False clauses
+    """
+    unsatisfied = 0
+    for clause in literals:
+        for lit in clause:
+            if (lit>0) == (values[abs(lit)]==1):
+                break
+        else:
+            unsatisfied += 1
+    return unsatisfied
+
+def walksat(literals,n_vars,x,max_flips=1000,noise=0.5):
+    """Local search (WalkSAT) starting from a set of inputs: a variable
+    of a random False clause is flipped, preferring the variables which
+    make no other clause False (break count)
+    
+    Args:
+        literals (list): stores each clause as a list of ints
+        n_vars (int): number of variables in the function
+        x (dict): x-values of each variable to start from
+        max_flips (int): maximum number of flips
+        noise (float): probability of flipping a random variable of the
+            clause instead of the one with the lowest break count
+    
+    Returns:
+        solved (bool): are all clauses True?
+        x (dict): resulting values of each variable
+        flips (int): number of flips made
+    """
+    values = [0]*(n_vars+1)
+    for var in x:
+        values[int(var)] = x[var]
+    # clauses in which each literal occurs
+    occurrences = {}
+    for lit in range(1,n_vars+1):
+        occurrences[lit] = []
+        occurrences[-lit] = []
+    for idx,clause in enumerate(literals):
+        for lit in clause:
+            occurrences[lit].append(idx)
+    # number of True literals of each clause and the list of False ones
+    n_true = []
+    unsat = []
+    position = [-1]*len(literals)
+    for idx,clause in enumerate(literals):
+        n_true.append(0)
+        for lit in clause:
+            if (lit>0) == (values[abs(lit)]==1):
+                n_true[idx] += 1
+        if n_true[idx] == 0:
+            position[idx] = len(unsat)
+            unsat.append(idx)
+
+    def true_literal(var):
+        return var if values[var]==1 else -var
+
+    def break_count(var):
+        count = 0
+        for idx in occurrences[true_literal(var)]:
+            if n_true[idx] == 1:
+                count += 1
+        return count
+
+    flips = 0
+    while unsat and flips < max_flips:
+        flips += 1
+        clause = literals[random.choice(unsat)]
+        breaks = [break_count(abs(lit)) for lit in clause]
+        least = min(breaks)
+        if least > 0 and random.random() < noise:
+            var = abs(random.choice(clause))
+        else:
+            var = abs(random.choice(
+                [lit for lit,b in zip(clause,breaks) if b == least]))
+        old = true_literal(var)
+        values[var] = 1-values[var]
+        for idx in occurrences[old]:
+            n_true[idx] -= 1
+            if n_true[idx] == 0:
+                position[idx] = len(unsat)
+                unsat.append(idx)
+        for idx in occurrences[-old]:
+            n_true[idx] += 1
+            if n_true[idx] == 1:
+                # removing the clause from the list of False ones
+                last = unsat.pop()
+                if last != idx:
+                    unsat[position[idx]] = last
+                    position[last] = position[idx]
+                position[idx] = -1
+    result = {}
+    for i in range(1,n_vars+1):
+        result[str(i)] = values[i]
+    return not unsat, result, flips
+
+def run_amoeba(INTRA,INTER,CONTRA,n_vars,type_of_Z,e,**kwargs):
+    """Run the dynamics of the system until it is stable
+    
+    Args:
+        INTRA (list): stores each INTRA rule as a list of strings
+        INTER (list): stores each INTER rule with P and Q as elements
+        CONTRA (list): stores each CONTRA rule as a list of strings
+        n_vars (int): number of variables in the function
+        type_of_Z (string): which function to run for defining Z-states
+        e (int): parameter eta for tuning Y-states
+        max_count (int): stop after this many iterations (optional)
+        restart (string): restart schedule when the number of unstable
+            units stops decreasing, "fixed", "geometric" or "luby"
+            (optional, no restarts by default)
+        restart_base (int): iterations without progress before the first
+            restart (1000 by default)
+        restart_factor (float): growth of the geometric schedule
+        restart_action (string): "reseed" or "perturb" (by default)
+        perturb (float): proportion of units perturbed at a restart
+        recorder (TrajectoryRecorder): records the states of the system
+            every recorder.every iterations and the final state (optional)
+        clauses (list): stores each clause as a list of strings, needed
+            for the hybrid mode
+        hybrid_threshold (int): hand off to WalkSAT when at most this
+            many clauses are False for the x-values (optional)
+        hybrid_every (int): check the False clauses every this many
+            iterations; after a failed WalkSAT run the next one waits
+            twice as long as the previous wait, unless fewer clauses are
+            False than at the failed run
+        max_flips (int): maximum number of flips of one WalkSAT run
+        noise (float): noise parameter of WalkSAT
+        progress (function): called as progress(count, x) every
+            progress_every iterations (optional)
+        progress_every (int): iterations between calls of progress
+    
+    Returns:
+        result (dict): number of iterations ("count"), is the problem
+            solved ("solved"), number of restarts ("restarts"), the
+            resulting states of the variables ("x"), which phase found
+            them ("phase", "amoeba" or "walksat") and the number of
+            WalkSAT flips ("flips")
+    """
+    if type_of_Z == "logistic":
+        def next_Z(Z, count):
+            return run_Logistic_Z(Z, count)
+    elif type_of_Z == "brownian":
+        def next_Z(Z, count):
+            return run_Brownian_Z(Z)
+    else:
+        raise ValueError("unknown type of Z: "+str(type_of_Z))
+    max_count = kwargs.get("max_count")
+    restart = kwargs.get("restart")
+    restart_base = kwargs.get("restart_base", 1000)
+    restart_factor = kwargs.get("restart_factor", 1.5)
+    restart_action = kwargs.get("restart_action", "perturb")
+    perturb = kwargs.get("perturb", 0.1)
+    recorder = kwargs.get("recorder")
+    hybrid_threshold = kwargs.get("hybrid_threshold")
+    hybrid_every = kwargs.get("hybrid_every", 10)
+    max_flips = kwargs.get("max_flips", 1000)
+    noise = kwargs.get("noise", 0.5)
+    if hybrid_threshold is not None:
+        literals = compile_clauses(kwargs["clauses"])
+    progress = kwargs.get("progress")
+    progress_every = kwargs.get("progress_every", 100)
+
+    X={}
+    Y={}
+    Z={}
+    L={}
+    x={}
+    for i in range(1,n_vars+1):
+        X[str(i)+'0'] = 0
+        X[str(i)+'1'] = 0
+        Y[str(i)+'0'] = 0
+        Y[str(i)+'1'] = 0
+        Z[str(i)+'0'] = 0
+        Z[str(i)+'1'] = 0
+        L[str(i)+'0'] = 0
+        L[str(i)+'1'] = 0
+        x[str(i)] = 0
+
+    count=0
+    solved = False
+    restarts = 0
+    phase = "amoeba"
+    flips = 0
+    if hybrid_threshold is not None:
+        hybrid_wait = hybrid_every
+        next_walksat = 0
+        failed_unsat = hybrid_threshold+1
+    if restart is not None:
+        limit = restart_limit(restart, restarts, restart_base, restart_factor)
+        best_unstable = len(X)
+        last_progress = 0
+    
+    while not solved and (max_count is None or count < max_count):
+        count+=1
+        Z = next_Z(Z, count)
+        Y = run_Y(Y,Z,e,L)
+        X = run_X(X,Y)
+        L = run_L(X,L,INTRA,INTER,CONTRA)
+        x = run_x(x,X)
+        if recorder is not None and count % recorder.every == 0:
+            recorder.add(count,X,L,x)
+        if progress is not None and count % progress_every == 0:
+            progress(count,x)
+        if hybrid_threshold is not None and count % hybrid_every == 0:
+            values = [0]+[x[str(i)] for i in range(1,n_vars+1)]
+            unsat = count_unsatisfied(literals,values)
+            if unsat == 0:
+                # the x-values of the amoeba already satisfy the function
+                solved = True
+                break
+            if unsat <= hybrid_threshold and (count >= next_walksat
+                                              or unsat < failed_unsat):
+                found, assignment, n_flips = walksat(literals,n_vars,x,
+                                                     max_flips,noise)
+                flips += n_flips
+                if found:
+                    x = assignment
+                    solved = True
+                    phase = "walksat"
+                    break
+                # backing off after a failed run
+                hybrid_wait *= 2
+                next_walksat = count+hybrid_wait
+                failed_unsat = unsat
+        if restart is None:
+            solved = check_solved(X,L)
+            continue
+        unstable = count_unstable(X,L)
+        solved = unstable == 0
+        if unstable < best_unstable:
+            best_unstable = unstable
+            last_progress = count
+        elif count-last_progress >= limit and not solved:
+            X, Z = restart_system(X,Z,restart_action,perturb)
+            restarts += 1
+            limit = restart_limit(restart, restarts, restart_base,
+                                  restart_factor)
+            best_unstable = len(X)
+            last_progress = count
+
+    # the final state is always recorded (again if WalkSAT changed x)
+    if recorder is not None and count > 0 and (
+            count % recorder.every != 0 or phase == "walksat"):
+        recorder.add(count,X,L,x)
+
+    return {"count": count, "solved": solved, "restarts": restarts, "x": x,
+            "phase": phase, "flips": flips}
+
 def check_solution(clauses,x):
     """Check the statements of each clauases in a function based on a 
     set of inputs
@@ -310,6 +668,11 @@ def main(*args, **kwargs):
     Args:
         type_of_Z (string): which function to run for defining Z-states
         e (int): parameter eta for tuning Y-states
+        filename (string): path of the file (asked for if not given)
+        other keyword arguments are passed to run_amoeba
+    
+    Returns:
+        result (dict): result of run_amoeba
     """
     if "filename" not in kwargs:
         string = 'Please indicate the path of the file: '
@@ -317,50 +680,20 @@ def main(*args, **kwargs):
     else:
         filename = kwargs["filename"]
     clauses, n_vars = user_input(filename)
-    e = kwargs["e"]
-    X={}
-    Y={}
-    Z={}
-    L={}
-    x={}
-    for i in range(1,n_vars+1):
-        X[str(i)+'0'] = 0
-        X[str(i)+'1'] = 0
-        Y[str(i)+'0'] = 0
-        Y[str(i)+'1'] = 0
-        Z[str(i)+'0'] = 0
-        Z[str(i)+'1'] = 0
-        L[str(i)+'0'] = 0
-        L[str(i)+'1'] = 0
-        x[str(i)] = 0
     
     # creating rulesets
     INTRA = create_INTRA(n_vars)
     INTER = create_INTER(clauses)
     CONTRA = create_CONTRA(INTER)
 
-    count=0
-    solved = False
-    
-    if kwargs["type_of_Z"] == "logistic":
-        while not solved:
-            count+=1
-            Z = run_Logistic_Z(Z, count)
-            Y = run_Y(Y,Z,e,L)
-            X = run_X(X,Y)
-            L = run_L(X,L,INTRA,INTER,CONTRA)
-            x = run_x(x,X)
-            solved = check_solved(X,L)
-    
-    elif kwargs["type_of_Z"] == "brownian":
-        while not solved:
-            count+=1
-            Z = run_Brownian_Z(Z)
-            Y = run_Y(Y,Z,e,L)
-            X = run_X(X,Y)
-            L = run_L(X,L,INTRA,INTER,CONTRA)
-            x = run_x(x,X)
-            solved = check_solved(X,L)
+    options = {"clauses": clauses}
+    for key in kwargs:
+        if key not in ("filename", "type_of_Z", "e"):
+            options[key] = kwargs[key]
+    result = run_amoeba(INTRA, INTER, CONTRA, n_vars, kwargs["type_of_Z"],
+                        kwargs["e"], **options)
+    count = result["count"]
+    x = result["x"]
 
     # outputing resulting states of the variables
     string = ""
@@ -370,7 +703,18 @@ def main(*args, **kwargs):
     string = "It took total of "+str(count)
     string += " iterations to find the variables"
     print(string+'\n')
+    if result["restarts"] > 0:
+        print("Restarts made: "+str(result["restarts"])+'\n')
+    if result["phase"] == "walksat":
+        string = "The solution was found by WalkSAT with "
+        string += str(result["flips"])+" flips in total"
+        print(string+'\n')
+    elif result["flips"] > 0:
+        string = "WalkSAT made "+str(result["flips"])
+        string += " flips without finding the solution"
+        print(string+'\n')
     check_solution(clauses,x)
+    return result
 
 if __name__ == "__main__":
     main(type_of_Z = "logistic", e = 0.1)
@@ -0,0 +1,158 @@
+"""
+recorder.py
+
+A module to record the trajectory (X-, L- and x-values of each iteration)
+of AmoebaSAT runs with low overhead. The states are packed into a
+preallocated ring buffer, either in memory or in a memory-mapped file,
+and only the last states are kept.
+"""
+
+#### Libraries
+# Standard library
+import array
+import mmap
+import os
+import struct
+
+# header: magic, n_vars, capacity, every, number of recorded states
+HEADER = struct.Struct('<4sIIIQ')
+MAGIC = b'AMBT'
+
+def record_struct(n_vars):
+    """Create the packing format of one recorded state: iteration number,
+    X- and L-values of each unit and x-values of each variable
+
+    Args:
+        n_vars (int): number of variables in the function
+
+    Returns:
+        (struct.Struct): format of one record
+    """
+    return struct.Struct('<I'+str(5*n_vars)+'b')
+
+class TrajectoryRecorder:
+    """Ring buffer of packed states of the system
+
+    Args:
+        n_vars (int): number of variables in the function
+        capacity (int): number of last states to keep
+        every (int): record the state every this many iterations
+        filename (string): path of the file to map the buffer to
+            (optional, the buffer is kept in memory by default)
+    """
+    def __init__(self, n_vars, capacity=1000, every=1, filename=None):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        if every < 1:
+            raise ValueError("every must be at least 1")
+        self.n_vars = n_vars
+        self.capacity = capacity
+        self.every = every
+        self.filename = filename
+        self.written = 0
+        self.record = record_struct(n_vars)
+        size = HEADER.size+capacity*self.record.size
+        if filename is None:
+            self.file = None
+            self.buffer = bytearray(size)
+        else:
+            self.file = open(filename, 'w+b')
+            self.file.truncate(size)
+            self.buffer = mmap.mmap(self.file.fileno(), size)
+        self.write_header()
+
+    def write_header(self):
+        HEADER.pack_into(self.buffer, 0, MAGIC, self.n_vars, self.capacity,
+                         self.every, self.written)
+
+    def add(self, count, X, L, x):
+        """Pack the current state into the next slot of the buffer
+
+        Args:
+            count (int): number of iterations made
+            X (dict): current X-values of each unit
+            L (dict): current L-values of each unit
+            x (dict): current x-values of each variable
+        """
+        slot = self.written % self.capacity
+        self.record.pack_into(self.buffer,
+                              HEADER.size+slot*self.record.size, count,
+                              *X.values(), *L.values(), *x.values())
+        self.written += 1
+        self.write_header()
+
+    def states(self):
+        """Unpack the recorded states in the order of iterations
+
+        Returns:
+            (dict): see unpack_states
+        """
+        return unpack_states(self.buffer)
+
+    def close(self):
+        if self.file is not None:
+            self.buffer.flush()
+            self.buffer.close()
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def unpack_states(buffer):
+    """Read recorded states from a buffer written by TrajectoryRecorder
+
+    Args:
+        buffer (bytes-like): header followed by the ring of records
+
+    Returns:
+        states (dict): iteration numbers ("iteration", array of ints),
+            X-, L- and x-values ("X", "L", "x", one flat array each with
+            the values of one recorded state after another, e.g. the
+            X-value of unit j in record r is X[r*len(units)+j]) and names
+            of units ("units") and variables ("vars") in the order of the
+            values; the values are copied out of the buffer
+    """
+    magic, n_vars, capacity, every, written = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError("not a trajectory file")
+    record = record_struct(n_vars)
+    n_units = 2*n_vars
+    if written > capacity:
+        slots = [(written+i) % capacity for i in range(capacity)]
+    else:
+        slots = list(range(written))
+    states = {"iteration": array.array('I'), "X": array.array('b'),
+              "L": array.array('b'), "x": array.array('b'),
+              "every": every, "units": [], "vars": []}
+    for i in range(1, n_vars+1):
+        states["units"] += [str(i)+'0', str(i)+'1']
+        states["vars"].append(str(i))
+    for slot in slots:
+        start = HEADER.size+slot*record.size
+        states["iteration"].append(
+            struct.unpack_from('<I', buffer, start)[0])
+        start += 4
+        states["X"].frombytes(buffer[start:start+n_units])
+        states["L"].frombytes(buffer[start+n_units:start+2*n_units])
+        states["x"].frombytes(buffer[start+2*n_units:start+record.size-4])
+    return states
+
+def load_trajectory(filename):
+    """Read a trajectory file written by TrajectoryRecorder (through a
+    read-only memory map) into arrays
+
+    Args:
+        filename (string): path of the trajectory file
+
+    Returns:
+        states (dict): see unpack_states
+    """
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < HEADER.size:
+            raise ValueError("not a trajectory file")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            return unpack_states(buffer)
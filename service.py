@@ -0,0 +1,403 @@
+"""
+service.py
+
+A long-running local service solving SAT problems with AmoebaSAT. Jobs
+are sent over HTTP, the rulesets of each function are kept in an LRU
+cache of each worker process between jobs and the solving runs on a pool
+of processes. The progress of a job is streamed back to the client as
+lines of JSON, and a job is stopped when its client goes away.
+
+Run `python3 service.py --port 8765` and send a job with
+
+    curl -N -d '{"dimacs": "...", "e": 0.1, "max_count": 100000}' \
+        http://127.0.0.1:8765/solve
+"""
+
+#### Libraries
+# Standard library
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import hashlib
+import http.client
+import json
+import math
+import multiprocessing
+import numbers
+import random
+import signal
+
+# My library
+from myAmbSAT import (parse_dimacs, create_INTRA, create_INTER,
+                      create_CONTRA, compile_clauses, count_unsatisfied,
+                      run_amoeba)
+
+# options of run_amoeba which can be set by a job
+JOB_OPTIONS = ("max_count", "restart", "restart_base", "restart_factor",
+               "restart_action", "perturb", "hybrid_threshold",
+               "hybrid_every", "max_flips", "noise", "progress_every")
+
+# the most iterations between two progress events (and checks whether
+# the job was cancelled)
+MAX_PROGRESS_EVERY = 1000
+
+# compiled functions of a worker process by the hash of their text
+worker_cache = collections.OrderedDict()
+worker_cache_size = 32
+
+class JobCancelled(Exception):
+    """The client of the job went away"""
+
+def compile_instance(dimacs):
+    """Create the rulesets of a function given in DIMACS format
+
+    Args:
+        dimacs (string): text of the file which describes the function
+
+    Returns:
+        instance (dict): clauses, their literals, number of variables
+            and the rulesets
+    """
+    clauses, n_vars = parse_dimacs(dimacs.splitlines())
+    INTER = create_INTER(clauses)
+    return {"clauses": clauses, "literals": compile_clauses(clauses),
+            "n_vars": n_vars, "INTRA": create_INTRA(n_vars), "INTER": INTER,
+            "CONTRA": create_CONTRA(INTER)}
+
+def init_worker(cache_size):
+    """Prepare a worker process: stopping the workers is left to the
+    service
+
+    Args:
+        cache_size (int): number of compiled functions kept in the worker
+    """
+    global worker_cache_size
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker_cache_size = cache_size
+
+def worker_instance(key, dimacs):
+    """Find the compiled function in the cache of the worker process or
+    compile it
+
+    Args:
+        key (string): hash of the text
+        dimacs (string): text of the file which describes the function
+
+    Returns:
+        instance (dict): result of compile_instance
+    """
+    if key in worker_cache:
+        worker_cache.move_to_end(key)
+        return worker_cache[key]
+    instance = compile_instance(dimacs)
+    worker_cache[key] = instance
+    while len(worker_cache) > worker_cache_size:
+        worker_cache.popitem(last=False)
+    return instance
+
+def solve_job(job_id, key, dimacs, type_of_Z, e, options, events,
+              cancelled):
+    """Solve one job in a worker process, sending the progress to the
+    service
+
+    Args:
+        job_id (int): number of the job
+        key (string): hash of the text of the function
+        dimacs (string): text of the file which describes the function
+        type_of_Z (string): which function to run for defining Z-states
+        e (int): parameter eta for tuning Y-states
+        options (dict): other keyword arguments of run_amoeba
+        events (Queue): queue shared with the service
+        cancelled (dict): ids of the jobs whose client went away
+
+    Returns:
+        result (dict): result of run_amoeba (None if cancelled)
+    """
+    instance = worker_instance(key, dimacs)
+    literals = instance["literals"]
+    n_vars = instance["n_vars"]
+    best = [len(literals)]
+
+    def progress(count, x):
+        if job_id in cancelled:
+            raise JobCancelled()
+        values = [0]+[x[str(i)] for i in range(1,n_vars+1)]
+        best[0] = min(best[0], count_unsatisfied(literals, values))
+        events.put((job_id, {"event": "progress", "count": count,
+                             "best_unsatisfied": best[0]}))
+
+    random.seed()
+    try:
+        return run_amoeba(instance["INTRA"], instance["INTER"],
+                          instance["CONTRA"], n_vars, type_of_Z, e,
+                          clauses=instance["clauses"], progress=progress,
+                          **options)
+    except JobCancelled:
+        return None
+
+class SolverService:
+    """Accept jobs over HTTP and run them on a process pool
+
+    Args:
+        workers (int): number of worker processes
+        cache_size (int): number of compiled functions kept in memory
+        max_count (int): iteration budget of jobs which do not set one
+        max_count_limit (int): largest iteration budget a job can set
+    """
+    def __init__(self, workers=None, cache_size=32, max_count=1000000,
+                 max_count_limit=100000000):
+        self.cache_size = cache_size
+        self.max_count = max_count
+        self.max_count_limit = max_count_limit
+        # hashes of the functions which were parsed without errors
+        self.cache = collections.OrderedDict()
+        # workers are spawned, forking would copy the locks held by the
+        # thread forwarding the progress
+        context = multiprocessing.get_context('spawn')
+        self.pool = concurrent.futures.ProcessPoolExecutor(
+            workers, mp_context=context, initializer=init_worker,
+            initargs=(cache_size,))
+        self.manager = context.Manager()
+        self.events = self.manager.Queue()
+        self.cancelled = self.manager.dict()
+        self.streams = {}
+        self.n_jobs = 0
+        self.stopped = False
+
+    async def check_instance(self, dimacs):
+        """Check that the function can be parsed (once for each text)
+
+        Args:
+            dimacs (string): text of the file which describes the function
+
+        Returns:
+            key (string): hash of the text
+        """
+        key = hashlib.sha1(dimacs.encode()).hexdigest()
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return key
+        loop = asyncio.get_running_loop()
+        try:
+            clauses, n_vars = await loop.run_in_executor(
+                None, parse_dimacs, dimacs.splitlines())
+        except Exception:
+            raise ValueError("the dimacs can not be parsed")
+        if not clauses:
+            raise ValueError("the dimacs has no clauses")
+        self.cache[key] = n_vars
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return key
+
+    def job_options(self, job):
+        """Check "type_of_Z" and "e" of a job and take the options of
+        run_amoeba from it, with a limited iteration budget
+
+        Args:
+            job (dict): the job sent by the client
+
+        Returns:
+            options (dict): keyword arguments of run_amoeba
+        """
+        if job.get("type_of_Z", "logistic") not in ("logistic", "brownian"):
+            raise ValueError('type_of_Z must be "logistic" or "brownian"')
+        e = job.get("e", 0.1)
+        if (isinstance(e, bool) or not isinstance(e, numbers.Real)
+                or not math.isfinite(e)):
+            raise ValueError("e must be a number")
+        options = {}
+        for key in JOB_OPTIONS:
+            if key in job:
+                options[key] = job[key]
+        max_count = options.get("max_count", self.max_count)
+        if not isinstance(max_count, int) or max_count < 1:
+            raise ValueError("max_count must be a positive integer")
+        options["max_count"] = min(max_count, self.max_count_limit)
+        progress_every = options.get("progress_every", 100)
+        if not isinstance(progress_every, int) or progress_every < 1:
+            raise ValueError("progress_every must be a positive integer")
+        options["progress_every"] = min(progress_every, MAX_PROGRESS_EVERY)
+        return options
+
+    async def forward_events(self):
+        """Pass the progress sent by the workers to the job streams"""
+        loop = asyncio.get_running_loop()
+        while True:
+            job_id, event = await loop.run_in_executor(None, self.events.get)
+            if job_id is None:
+                break
+            if job_id in self.streams:
+                self.streams[job_id].put_nowait(event)
+
+    def job_finished(self, job_id, future):
+        if not self.stopped:
+            self.cancelled.pop(job_id, None)
+        if not future.cancelled():
+            future.exception()
+
+    async def solve(self, job, key, options, closed):
+        """Run one job, yielding its progress and finally its result
+
+        Args:
+            job (dict): "dimacs", "e" and "type_of_Z" of the job
+            key (string): hash of the text of the function
+            options (dict): keyword arguments of run_amoeba
+            closed (Future): done when the client went away
+        """
+        self.n_jobs += 1
+        job_id = self.n_jobs
+        stream = asyncio.Queue()
+        self.streams[job_id] = stream
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.pool, solve_job, job_id, key,
+                                      job["dimacs"],
+                                      job.get("type_of_Z", "logistic"),
+                                      job.get("e", 0.1), options,
+                                      self.events, self.cancelled)
+        try:
+            while not future.done() or not stream.empty():
+                getter = asyncio.ensure_future(stream.get())
+                await asyncio.wait([getter, future, closed],
+                                   return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    yield getter.result()
+                else:
+                    getter.cancel()
+                if closed.done():
+                    raise ConnectionResetError("the client went away")
+            try:
+                result = future.result()
+            except Exception as err:
+                yield {"event": "error", "error": repr(err)}
+                return
+            result["event"] = "result"
+            yield result
+        finally:
+            del self.streams[job_id]
+            # after the service stopped, the jobs and the manager are gone
+            if not self.stopped:
+                if not future.done():
+                    # stopping the job at its next progress event
+                    self.cancelled[job_id] = True
+                future.add_done_callback(
+                    lambda future: self.job_finished(job_id, future))
+
+    async def handle(self, reader, writer):
+        """Serve one HTTP request"""
+        try:
+            request = await reader.readline()
+            method, path = request.decode().split()[:2]
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, value = line.decode().split(':', 1)
+                if name.strip().lower() == 'content-length':
+                    length = int(value)
+            body = await reader.readexactly(length)
+            if method == 'GET' and path == '/status':
+                await self.respond(writer, 200, {
+                    "jobs": self.n_jobs, "running": len(self.streams),
+                    "cached": len(self.cache)})
+            elif method == 'POST' and path == '/solve':
+                job = json.loads(body)
+                if not isinstance(job, dict):
+                    raise ValueError("the job must be a JSON object")
+                if not isinstance(job.get("dimacs"), str):
+                    raise ValueError("the job has no dimacs")
+                options = self.job_options(job)
+                key = await self.check_instance(job["dimacs"])
+                writer.write(b'HTTP/1.1 200 OK\r\n'
+                             b'Content-Type: application/x-ndjson\r\n'
+                             b'Connection: close\r\n\r\n')
+                # the client sends nothing more, reading ends when it closes
+                closed = asyncio.ensure_future(reader.read())
+                events = self.solve(job, key, options, closed)
+                try:
+                    async for event in events:
+                        writer.write(json.dumps(event).encode()+b'\n')
+                        await writer.drain()
+                finally:
+                    await events.aclose()
+                    closed.cancel()
+            else:
+                await self.respond(writer, 404, {"error": "not found"})
+        except (ValueError, KeyError, asyncio.IncompleteReadError) as err:
+            try:
+                await self.respond(writer, 400, {"error": str(err)})
+            except ConnectionError:
+                pass
+        except (ConnectionError, asyncio.CancelledError):
+            # the client went away or the service is stopping
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, content):
+        body = json.dumps(content).encode()+b'\n'
+        writer.write(('HTTP/1.1 '+str(status)+' '
+                      +http.client.responses[status]+'\r\n'
+                      'Content-Type: application/json\r\n'
+                      'Content-Length: '+str(len(body))+'\r\n'
+                      'Connection: close\r\n\r\n').encode()+body)
+        await writer.drain()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port)
+        forwarder = asyncio.ensure_future(self.forward_events())
+        print("Serving on http://"+host+":"+str(port))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            # stopping the running jobs at their next progress event and
+            # dropping the waiting ones
+            for job_id in self.streams:
+                self.cancelled[job_id] = True
+            self.events.put((None, None))
+            await forwarder
+            self.pool.shutdown(cancel_futures=True)
+            self.stopped = True
+            self.manager.shutdown()
+
+def solve_remote(dimacs, host="127.0.0.1", port=8765, **job):
+    """Send a job to a running service, yielding the streamed events
+
+    Args:
+        dimacs (string): text of the file which describes the function
+        host (string): address of the service
+        port (int): port of the service
+        other keyword arguments ("e", "type_of_Z", options of run_amoeba)
+            are sent with the job
+    """
+    job["dimacs"] = dimacs
+    connection = http.client.HTTPConnection(host, port)
+    connection.request('POST', '/solve', json.dumps(job),
+                       {'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    if response.status != 200:
+        raise RuntimeError(response.read().decode())
+    for line in response:
+        yield json.loads(line)
+    connection.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Local AmoebaSAT service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--cache', type=int, default=32)
+    parser.add_argument('--max-count', type=int, default=1000000,
+                        help='iteration budget of jobs which do not set one')
+    parser.add_argument('--max-count-limit', type=int, default=100000000,
+                        help='largest iteration budget a job can set')
+    args = parser.parse_args()
+    service = SolverService(args.workers, args.cache, args.max_count,
+                            args.max_count_limit)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
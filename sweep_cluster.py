@@ -0,0 +1,424 @@
+"""
+sweep_cluster.py
+
+Run the trials of trials_code.py (every function of a folder, every eta
+value, a number of trials each) on several hosts. A coordinator splits
+the sweep into tasks of (function, eta, block of trials) and workers
+pull the tasks over a socket and send back the iteration counts. A task
+is leased to a worker for a limited time, the tasks of workers which
+stop responding are given to other workers. The functions are read one
+by one while the sweep runs, so a large folder or archive is not loaded
+into memory up front.
+
+    python3 sweep_cluster.py coordinator --host 0.0.0.0 --authkey <key> \
+        --folder uf20-91 --out uf20-91-1
+    python3 sweep_cluster.py worker --host <coordinator host> --authkey <key>
+    python3 sweep_cluster.py local --workers 4 --folder uf20-91
+
+The results are saved in the same way as in trials_code.py: one file
+trials<eta>.csv with the counts for each function and eta, written as
+soon as all trials of the function are finished.
+"""
+
+#### Libraries
+# Standard library
+import argparse
+import collections
+import csv
+import ipaddress
+import multiprocessing
+import multiprocessing.connection
+import os
+import socket
+import threading
+import time
+
+# My library
+from instances import iter_dimacs
+from myAmbSAT import (parse_dimacs, create_INTRA, create_INTER,
+                      create_CONTRA, run_amoeba)
+
+# seconds given to a new connection to answer the key challenge
+HANDSHAKE_TIMEOUT = 10.0
+
+class Coordinator:
+    """Hand out the tasks of a sweep and collect the results
+
+    The functions are read while the sweep runs: the tasks of a function
+    are added when it is read, and at most ahead functions with unfinished
+    tasks are kept in memory. The counts of a function are written as soon
+    as all its tasks are finished.
+
+    Args:
+        instances (iterable): name and text in DIMACS format of each
+            function, e.g. iter_dimacs(path)
+        main_foldername (string): folder of the results
+        es (list): eta values
+        n_trials (int): number of trials for each function and eta
+        block (int): number of trials in one task
+        lease (float): seconds after which a task of a silent worker is
+            given to another worker
+        type_of_Z (string): which function to run for defining Z-states
+        ahead (int): maximum number of functions with unfinished tasks
+    """
+    def __init__(self, instances, main_foldername, es, n_trials, block=50,
+                 lease=60.0, type_of_Z="logistic", ahead=8):
+        self.main_foldername = main_foldername
+        self.es = es
+        self.n_trials = n_trials
+        self.block = block
+        self.lease = lease
+        self.type_of_Z = type_of_Z
+        self.ahead = ahead
+        self.lock = threading.Condition()
+        self.pending = collections.deque()
+        self.leases = {} # task id -> (worker, deadline)
+        self.tasks = {}
+        self.finished = set() # ids of the finished tasks
+        self.counts = {} # task id -> counts of a function not yet written
+        self.instances = {} # texts of the functions with unfinished tasks
+        self.unfinished = {} # number of unfinished tasks by function
+        self.function_tasks = {} # ids of the tasks of each function
+        self.feeding = True
+        self.error = None
+        self.feeder = threading.Thread(target=self.feed, args=(instances,),
+                                       daemon=True)
+
+    def feed(self, instances):
+        """Add the tasks of each function as it is read"""
+        try:
+            for name, text in instances:
+                with self.lock:
+                    self.lock.wait_for(
+                        lambda: len(self.instances) < self.ahead)
+                    self.instances[name] = text
+                    self.unfinished[name] = 0
+                    self.function_tasks[name] = []
+                    for e in self.es:
+                        for start in range(0, self.n_trials, self.block):
+                            task = {"id": len(self.tasks), "name": name,
+                                    "e": e, "start": start,
+                                    "size": min(self.block,
+                                                self.n_trials-start)}
+                            self.tasks[task["id"]] = task
+                            self.pending.append(task["id"])
+                            self.function_tasks[name].append(task["id"])
+                            self.unfinished[name] += 1
+                    if not self.unfinished[name]:
+                        del self.instances[name], self.unfinished[name]
+                        del self.function_tasks[name]
+        except Exception as err:
+            self.error = err
+        finally:
+            with self.lock:
+                self.feeding = False
+
+    def done(self):
+        with self.lock:
+            return (not self.feeding
+                    and len(self.finished) == len(self.tasks))
+
+    def next_task(self, worker):
+        """Lease the next pending task to a worker
+
+        Returns:
+            reply (tuple): ("task", task, dimacs), ("wait", seconds) if all
+                tasks are leased or ("stop",) if the sweep is finished
+        """
+        with self.lock:
+            while self.pending:
+                task_id = self.pending.popleft()
+                if task_id not in self.finished:
+                    self.leases[task_id] = (worker,
+                                            time.time()+self.lease)
+                    task = dict(self.tasks[task_id])
+                    task["type_of_Z"] = self.type_of_Z
+                    task["lease"] = self.lease
+                    return ("task", task, self.instances[task["name"]])
+            if not self.feeding and len(self.finished) == len(self.tasks):
+                return ("stop",)
+            return ("wait", min(1.0, self.lease/4))
+
+    def renew(self, worker, task_id):
+        """Extend the lease of a task which is still running"""
+        with self.lock:
+            if task_id in self.leases and self.leases[task_id][0] == worker:
+                self.leases[task_id] = (worker, time.time()+self.lease)
+
+    def finish(self, worker, task_id, counts):
+        """Store the counts of a task (the first result of a task is kept
+        if it was run twice) and write the counts of its function once all
+        its tasks are finished"""
+        with self.lock:
+            self.leases.pop(task_id, None)
+            if task_id not in self.finished:
+                self.finished.add(task_id)
+                self.counts[task_id] = counts
+                name = self.tasks[task_id]["name"]
+                self.unfinished[name] -= 1
+                if not self.unfinished[name]:
+                    # writing the counts before the task counts as done, so
+                    # that nothing is lost when the coordinator stops
+                    save_results(self.function_results(name),
+                                 self.main_foldername)
+                    del self.instances[name], self.unfinished[name]
+                    self.lock.notify_all()
+
+    def requeue_expired(self):
+        """Give the tasks with an expired lease back to the queue
+
+        Returns:
+            (list): ids of the requeued tasks
+        """
+        now = time.time()
+        expired = []
+        with self.lock:
+            for task_id, (worker, deadline) in list(self.leases.items()):
+                if deadline < now:
+                    del self.leases[task_id]
+                    self.pending.appendleft(task_id)
+                    expired.append(task_id)
+        return expired
+
+    def serve_worker(self, conn, authkey):
+        """Check the key of a worker and answer its requests until it
+        disconnects"""
+        with conn:
+            try:
+                authenticate(conn, authkey, HANDSHAKE_TIMEOUT)
+            except (EOFError, OSError, multiprocessing.AuthenticationError):
+                return
+            while True:
+                try:
+                    message = conn.recv()
+                except (EOFError, ConnectionError):
+                    return
+                if message[0] == "get":
+                    conn.send(self.next_task(message[1]))
+                elif message[0] == "renew":
+                    self.renew(message[1], message[2])
+                    conn.send(("ok",))
+                elif message[0] == "done":
+                    self.finish(message[1], message[2], message[3])
+                    conn.send(("ok",))
+
+    def function_results(self, name):
+        """Join the counts of the blocks of each eta of a finished function
+        and drop them from memory
+
+        Returns:
+            results (dict): counts of all trials by (name, eta)
+        """
+        results = {}
+        for task_id in self.function_tasks.pop(name):
+            key = (name, self.tasks[task_id]["e"])
+            results.setdefault(key, [])
+            results[key] += self.counts.pop(task_id)
+        return results
+
+    def run(self, address, authkey):
+        """Read the functions and serve the workers until all tasks are
+        finished"""
+        # the key is checked in the thread of each connection, so that a
+        # client which does not answer does not hold up the others
+        listener = multiprocessing.connection.Listener(address)
+
+        def accept():
+            while True:
+                try:
+                    conn = listener.accept()
+                except OSError:
+                    if self.done():
+                        return
+                    continue
+                threading.Thread(target=self.serve_worker,
+                                 args=(conn, authkey), daemon=True).start()
+
+        threading.Thread(target=accept, daemon=True).start()
+        starttime = time.time()
+        self.feeder.start()
+        while not self.done():
+            time.sleep(min(1.0, self.lease/4))
+            for task_id in self.requeue_expired():
+                task = self.tasks[task_id]
+                print("Requeued "+task["name"]+"/"+str(task["e"])
+                      +" trials from "+str(task["start"]))
+        listener.close()
+        print('That took {} seconds'.format(time.time()-starttime))
+
+def authenticate(conn, authkey, timeout):
+    """Run the key challenge of multiprocessing.connection on a new
+    connection, giving up on clients which do not answer in time
+
+    Args:
+        conn (Connection): connection accepted without a key
+        authkey (bytes): key shared with the workers
+        timeout (float): seconds given to the client to answer
+    """
+    # shutting down the socket wakes the challenge waiting for an answer
+    sock = socket.socket(fileno=os.dup(conn.fileno()))
+    watchdog = threading.Timer(timeout, sock.shutdown, (socket.SHUT_RDWR,))
+    watchdog.start()
+    try:
+        multiprocessing.connection.deliver_challenge(conn, authkey)
+        multiprocessing.connection.answer_challenge(conn, authkey)
+    finally:
+        watchdog.cancel()
+        watchdog.join()
+        sock.close()
+
+def save_results(results, main_foldername):
+    """Write the counts in the same way as trials_for of trials_code.py"""
+    for (name, e), counts in results.items():
+        direct = os.path.join(main_foldername, name)
+        os.makedirs(direct, exist_ok=True)
+        f = open(os.path.join(direct, "trials"+str(e)+".csv"), "w")
+        with f:
+            writer = csv.writer(f)
+            writer.writerow(counts)
+
+def request(conn, lock, message):
+    """Send a message to the coordinator and wait for the reply (the
+    connection is shared with the thread renewing the lease)"""
+    with lock:
+        conn.send(message)
+        return conn.recv()
+
+def renew_lease(conn, lock, name, task, stop):
+    """Renew the lease of a task three times per lease period until the
+    task is finished"""
+    while not stop.wait(task["lease"]/3):
+        try:
+            request(conn, lock, ("renew", name, task["id"]))
+        except (EOFError, ConnectionError, OSError):
+            return
+
+def run_worker(address, authkey, name=None, retry=30):
+    """Pull tasks from the coordinator and run their trials until the
+    sweep is finished
+
+    Args:
+        address (tuple): host and port of the coordinator
+        authkey (bytes): key shared with the coordinator
+        name (string): name of the worker (host and process id by default)
+        retry (int): seconds to wait for the coordinator to start
+    """
+    if name is None:
+        name = socket.gethostname()+":"+str(os.getpid())
+    # the tasks come grouped by function, only the rulesets of the last
+    # function are kept
+    current = None
+    starttime = time.time()
+    while True:
+        try:
+            conn = multiprocessing.connection.Client(address,
+                                                     authkey=authkey)
+            break
+        except ConnectionError:
+            if time.time()-starttime > retry:
+                return
+            time.sleep(0.5)
+    lock = threading.Lock()
+    with conn:
+        while True:
+            try:
+                reply = request(conn, lock, ("get", name))
+            except (EOFError, ConnectionError):
+                return
+            if reply[0] == "stop":
+                return
+            if reply[0] == "wait":
+                time.sleep(reply[1])
+                continue
+            task, dimacs = reply[1], reply[2]
+            if task["name"] != current:
+                clauses, n_vars = parse_dimacs(dimacs.splitlines())
+                INTRA = create_INTRA(n_vars)
+                INTER = create_INTER(clauses)
+                CONTRA = create_CONTRA(INTER)
+                current = task["name"]
+            counts = []
+            # renewing the lease also while a long trial is running
+            stop = threading.Event()
+            heartbeat = threading.Thread(target=renew_lease,
+                                         args=(conn, lock, name, task, stop),
+                                         daemon=True)
+            heartbeat.start()
+            for i in range(task["size"]):
+                result = run_amoeba(INTRA, INTER, CONTRA, n_vars,
+                                    task["type_of_Z"], task["e"])
+                counts.append(result["count"])
+            stop.set()
+            heartbeat.join()
+            try:
+                request(conn, lock, ("done", name, task["id"], counts))
+            except (EOFError, ConnectionError):
+                return
+
+def is_loopback(host):
+    """Is the address only reachable from this machine?"""
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Distributed sweep of eta values over a folder of '
+                    'functions')
+    parser.add_argument('mode', choices=('coordinator', 'worker', 'local'))
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address of the coordinator (0.0.0.0 to '
+                             'accept workers of other hosts)')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--authkey', default=None,
+                        help='key shared by the coordinator and the '
+                             'workers, required unless the host is a '
+                             'loopback address')
+    parser.add_argument('--folder', default='uf20-91')
+    parser.add_argument('--out', default='uf20-91-1')
+    parser.add_argument('--trials', type=int, default=500)
+    parser.add_argument('--block', type=int, default=50)
+    parser.add_argument('--es', type=float, nargs='+',
+                        default=[0.05, 0.1, 0.15, 0.2, 0.25])
+    parser.add_argument('--lease', type=float, default=60.0)
+    parser.add_argument('--workers', type=int, default=4,
+                        help='number of local workers (local mode)')
+    args = parser.parse_args()
+    address = (args.host, args.port)
+    # the connections exchange pickles, so anyone knowing the key can run
+    # code on the coordinator
+    if args.authkey is None:
+        if not is_loopback(args.host):
+            parser.error('--authkey is required when the host is not a '
+                         'loopback address')
+        args.authkey = 'amoeba'
+    authkey = args.authkey.encode()
+
+    if args.mode == 'worker':
+        run_worker(address, authkey)
+    else:
+        coordinator = Coordinator(iter_dimacs(args.folder), args.out,
+                                  args.es, args.trials, args.block,
+                                  args.lease)
+        processes = []
+        if args.mode == 'local':
+            # local workers standing in for the hosts; they are spawned,
+            # forking would copy the locks held by the threads of the
+            # coordinator
+            context = multiprocessing.get_context('spawn')
+            for i in range(args.workers):
+                p = context.Process(target=run_worker,
+                                    args=(address, authkey))
+                processes.append(p)
+        thread = threading.Thread(target=coordinator.run,
+                                  args=(address, authkey))
+        thread.start()
+        for p in processes:
+            p.start()
+        thread.join()
+        for p in processes:
+            p.join()
+        if coordinator.error is not None:
+            # the results of the functions read before the error are saved
+            raise coordinator.error